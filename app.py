@@ -1,115 +1,426 @@
+# Patch blocking I/O before pymongo/requests are imported so Gemini and
+# MongoDB calls yield to other requests under gevent workers
+from gevent import monkey
+monkey.patch_all()
+
 import os
+import re
 import sys
 import time
-from flask import Flask, request, jsonify
+import hashlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+import json
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
 from pymongo import MongoClient
 import requests
-from werkzeug.security import generate_password_hash, check_password_hash
+import orjson
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from werkzeug.security import check_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHash
 from bson import ObjectId
-from collections import defaultdict
-from heapq import nlargest
+from collections import Counter, OrderedDict
 from string import punctuation
 import nltk
-from nltk.tokenize import sent_tokenize, word_tokenize
 from nltk.corpus import stopwords
+import blingfire
+import numpy as np
 
-# Download required NLTK data
-nltk.download('punkt')
-nltk.download('stopwords')
+# Download required NLTK data only if it isn't already on disk
+try:
+    nltk.data.find('corpora/stopwords')
+except LookupError:
+    nltk.download('stopwords', quiet=True)
 
 # --- Flask and MongoDB Setup ---
 app = Flask(__name__)
 CORS(app)
 
+def rate_limit_key():
+    """Rate-limit by user ID when given, otherwise by client address"""
+    data = request.get_json(silent=True)
+    user_id = data.get('userId') if isinstance(data, dict) else None
+    return str(user_id or get_remote_address())
+
+limiter = Limiter(rate_limit_key, app=app, storage_uri="memory://")
+
 # MongoDB Atlas Connection
 MONGO_URI = "mongodb+srv://<username>:<password>@cluster0.0hkywqp.mongodb.net/?retryWrites=true&w=majority"
 DATABASE_NAME = "nlp_projects_db"
 COLLECTION_NAME = "vip_summaries"
 USERS_COLLECTION = "users"
+SUMMARY_CACHE_COLLECTION = "summary_cache"
+
+# Longest text accepted by /summarize, in characters
+MAX_TEXT_LENGTH = 200_000
+
+# Characters of original text returned per /history entry
+HISTORY_PREVIEW_LENGTH = 200
 
 # Gemini API Configuration
 API_KEY = "<Gemini api key>"
 API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-05-20:generateContent"
+STREAM_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-05-20:streamGenerateContent"
+
+# Shared HTTP session so Gemini calls reuse keep-alive connections
+gemini_session = requests.Session()
+gemini_session.mount('https://', HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.5,
+        backoff_jitter=0.3,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=frozenset(['POST'])
+    )
+))
+
+# Argon2id hasher for user passwords
+password_hasher = PasswordHasher(time_cost=2, memory_cost=64 * 1024, parallelism=2)
 
 # --- Database Initialization ---
 try:
-    client = MongoClient(MONGO_URI)
+    # connect=False lets each forked worker open its own pool lazily
+    client = MongoClient(
+        MONGO_URI,
+        maxPoolSize=50,
+        minPoolSize=5,
+        serverSelectionTimeoutMS=3000,
+        socketTimeoutMS=5000,
+        retryWrites=True,
+        connect=False
+    )
     db = client[DATABASE_NAME]
     collection = db[COLLECTION_NAME]
     users_collection = db[USERS_COLLECTION]
-    client.admin.command('ismaster')
-    print("Connected to MongoDB Atlas successfully!")
+    summary_cache = db[SUMMARY_CACHE_COLLECTION]
+    print("MongoDB Atlas client configured; connecting on first use.")
 except Exception as e:
-    print(f"Error connecting to MongoDB: {e}", file=sys.stderr)
+    print(f"Error configuring MongoDB client: {e}", file=sys.stderr)
     sys.exit(1)
 
+@app.cli.command('init-db')
+def init_db():
+    """Create the collection indexes; run once per deployment, not in every worker"""
+    # Index builds on a large collection can outlast socketTimeoutMS, so run them
+    # on a short-lived client without a socket timeout
+    with MongoClient(MONGO_URI, serverSelectionTimeoutMS=3000) as index_client:
+        index_collection = index_client[DATABASE_NAME][COLLECTION_NAME]
+        index_collection.create_index([("user_id", 1), ("timestamp", -1)])
+        # Older history documents have no text_hash, so only enforce uniqueness where it is set
+        index_collection.create_index(
+            [("user_id", 1), ("text_hash", 1)],
+            unique=True,
+            partialFilterExpression={"text_hash": {"$exists": True}}
+        )
+    print("MongoDB indexes are up to date.")
+
+# Stopwords and punctuation ignored when scoring sentences
+STOP_WORDS = frozenset(stopwords.words('english')) | frozenset(punctuation)
+
+# Email shape accepted at signup: local@domain.tld without whitespace
+EMAIL_PATTERN = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
 # --- Helper Functions ---
 def validate_email(email):
     """Validate email format"""
-    return '@' in email and '.' in email.split('@')[1]
+    return bool(EMAIL_PATTERN.match(email))
 
 def validate_password(password):
     """Validate password length"""
     return len(password) >= 6
 
+def hash_password(password):
+    """Hash a password with Argon2id"""
+    return password_hasher.hash(password)
+
+def verify_password(stored_hash, password):
+    """Check a password against an Argon2 hash or a legacy Werkzeug hash"""
+    if not stored_hash.startswith('$argon2'):
+        return check_password_hash(stored_hash, password)
+    try:
+        return password_hasher.verify(stored_hash, password)
+    except (VerificationError, InvalidHash):
+        return False
+
+def password_needs_rehash(stored_hash):
+    """Check whether a stored hash predates the current Argon2 parameters"""
+    return not stored_hash.startswith('$argon2') or password_hasher.check_needs_rehash(stored_hash)
+
+# Users confirmed to exist; misses aren't cached so junk IDs can't evict real users
+KNOWN_USERS_SIZE = 10_000
+known_users = OrderedDict()
+known_users_lock = threading.Lock()
+
+def user_exists(user_id):
+    """Check whether a user ID belongs to a registered user"""
+    with known_users_lock:
+        if user_id in known_users:
+            known_users.move_to_end(user_id)
+            return True
+
+    if users_collection.find_one({"_id": ObjectId(user_id)}, {"_id": 1}) is None:
+        return False
+
+    with known_users_lock:
+        known_users[user_id] = True
+        known_users.move_to_end(user_id)
+        if len(known_users) > KNOWN_USERS_SIZE:
+            known_users.popitem(last=False)
+    return True
+
 def local_summarize(text, max_sentences=3):
-    """Generate extractive summary using NLTK"""
-    sentences = sent_tokenize(text)
+    """Generate extractive summary using BlingFire tokenization"""
+    sentence_block = blingfire.text_to_sentences(text)
+    sentences = sentence_block.split('\n')
     if len(sentences) <= max_sentences:
         return text
         
-    stop_words = set(stopwords.words('english') + list(punctuation))
-    words = word_tokenize(text.lower())
+    # Lowercase once, then tokenize each sentence once and reuse the tokens for both passes
+    sentence_words = [blingfire.text_to_words(sentence).split(' ') for sentence in sentence_block.lower().split('\n')]
     
-    frequency = defaultdict(int)
-    for word in words:
-        if word not in stop_words:
-            frequency[word] += 1
+    frequency = Counter(word for words in sentence_words for word in words if word not in STOP_WORDS)
     
-    max_frequency = max(frequency.values()) if frequency else 1
-    for word in frequency:
-        frequency[word] /= max_frequency
+    max_frequency = frequency.most_common(1)[0][1] if frequency else 1
     
-    sentence_scores = defaultdict(int)
-    for i, sentence in enumerate(sentences):
-        for word in word_tokenize(sentence.lower()):
-            if word in frequency:
-                sentence_scores[i] += frequency[word]
+    # Scatter-add each token's frequency into its sentence's score
+    sentence_ids = np.repeat(np.arange(len(sentences)), [len(words) for words in sentence_words])
+    weights = np.fromiter((frequency.get(word, 0) for words in sentence_words for word in words),
+                          dtype=np.float64, count=len(sentence_ids))
+    sentence_scores = np.bincount(sentence_ids, weights=weights, minlength=len(sentences)) / max_frequency
     
-    top_sentences = nlargest(max_sentences, sentence_scores, key=sentence_scores.get)
+    # Stable sort so ties go to the earlier sentence
+    top_sentences = np.argsort(-sentence_scores, kind='stable')[:max_sentences]
     summary = ' '.join([sentences[i] for i in sorted(top_sentences)])
     
     return summary
 
-def gemini_summarize(text):
-    """Generate abstractive summary using Gemini API"""
-    if not API_KEY:
-        raise ValueError("Gemini API key is not set")
-
+def gemini_payload(text):
+    """Build the Gemini request body for summarizing text"""
     prompt = f"Please provide a concise summary of the following text in 2-3 sentences:\n\n{text}"
-    payload = {
+    return {
         "contents": [{
             "role": "user",
             "parts": [{"text": prompt}]
         }]
     }
 
-    for i in range(3):  # Retry up to 3 times
-        try:
-            response = requests.post(f"{API_URL}?key={API_KEY}", json=payload)
-            response.raise_for_status()
-            result = response.json()
-            
-            if 'candidates' in result and result['candidates']:
-                return result['candidates'][0]['content']['parts'][0]['text']
-        except (requests.exceptions.RequestException, KeyError) as e:
-            print(f"API call failed (attempt {i+1}): {e}", file=sys.stderr)
-            time.sleep(2 ** i)
+def gemini_summarize(text):
+    """Generate abstractive summary using Gemini API"""
+    if not API_KEY:
+        raise ValueError("Gemini API key is not set")
+
+    try:
+        response = gemini_session.post(f"{API_URL}?key={API_KEY}", json=gemini_payload(text), timeout=30)
+        response.raise_for_status()
+        result = response.json()
+        
+        if 'candidates' in result and result['candidates']:
+            return result['candidates'][0]['content']['parts'][0]['text']
+    except (requests.exceptions.RequestException, KeyError) as e:
+        print(f"API call failed: {e}", file=sys.stderr)
 
     raise Exception("Failed to get summary from Gemini API")
 
+def gemini_stream(text):
+    """Yield summary text chunks from the Gemini streaming API as they arrive"""
+    if not API_KEY:
+        raise ValueError("Gemini API key is not set")
+
+    with gemini_session.post(f"{STREAM_API_URL}?alt=sse&key={API_KEY}", json=gemini_payload(text),
+                             stream=True, timeout=30) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line.startswith(b'data:'):
+                continue
+            chunk = json.loads(line[len(b'data:'):])
+            for candidate in chunk.get('candidates', [])[:1]:
+                for part in candidate.get('content', {}).get('parts', []):
+                    if part.get('text'):
+                        yield part['text']
+
+def text_hash(text, method):
+    """Hash text together with the summarization method used"""
+    return hashlib.blake2b(text.encode(), digest_size=16, key=method.encode()).hexdigest()
+
+def history_text_hash(text):
+    """Hash text to identify a user's history entry, independent of method"""
+    return hashlib.blake2b(text.encode(), digest_size=12).hexdigest()
+
+def get_cached_summary(key):
+    """Look up a stored summary by text hash"""
+    cached = summary_cache.find_one({"_id": key}, {"summary": 1})
+    return cached['summary'] if cached else None
+
+def store_cached_summary(key, summary, method):
+    """Store a summary under its text hash"""
+    summary_cache.update_one(
+        {"_id": key},
+        {"$set": {"summary": summary, "method": method, "created_at": time.time()}},
+        upsert=True
+    )
+
+# Recently generated summaries, keyed by text hash so the texts themselves aren't retained
+RECENT_SUMMARIES_SIZE = 1024
+recent_summaries = OrderedDict()
+recent_summaries_lock = threading.Lock()
+
+def get_recent_summary(key):
+    """Look up a summary generated by this worker, marking it as recently used"""
+    with recent_summaries_lock:
+        summary = recent_summaries.get(key)
+        if summary is not None:
+            recent_summaries.move_to_end(key)
+        return summary
+
+def remember_summary(key, summary):
+    """Keep a summary in this worker's cache, evicting the least recently used"""
+    with recent_summaries_lock:
+        recent_summaries[key] = summary
+        recent_summaries.move_to_end(key)
+        if len(recent_summaries) > RECENT_SUMMARIES_SIZE:
+            recent_summaries.popitem(last=False)
+
+def cached_summarize(text, method, key):
+    """Return a summary, reusing any previously generated result for the same text hash"""
+    summary = get_recent_summary(key)
+    if summary is not None:
+        return summary
+
+    if method == "gemini":
+        # Only Gemini results are worth a database round-trip to share across workers
+        summary = get_cached_summary(key)
+        if summary is None:
+            summary = gemini_summarize(text)
+            store_cached_summary(key, summary, method)
+    else:
+        summary = local_summarize(text)
+
+    remember_summary(key, summary)
+    return summary
+
+# Summaries currently being computed, keyed by text hash
+inflight_summaries = {}
+inflight_lock = threading.Lock()
+
+def coalesced_summarize(text, method):
+    """Summarize text, sharing the result with identical requests already in flight"""
+    key = text_hash(text, method)
+    with inflight_lock:
+        future = inflight_summaries.get(key)
+        is_owner = future is None
+        if is_owner:
+            future = inflight_summaries[key] = Future()
+
+    if is_owner:
+        try:
+            future.set_result(cached_summarize(text, method, key))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with inflight_lock:
+                del inflight_summaries[key]
+
+    return future.result()
+
+# History writes run off the request path but are still acknowledged, so
+# failures such as a duplicate-key race on (user_id, text_hash) get logged
+history_writer = ThreadPoolExecutor(max_workers=4)
+# Unfinished history writes per user in this worker
+pending_history_writes = {}
+pending_history_lock = threading.Lock()
+
+def write_history(user_id, original_text, summary, method):
+    """Upsert a summary into the user's history, replacing any entry for the same text"""
+    collection.update_one(
+        {
+            "user_id": user_id,
+            "text_hash": history_text_hash(original_text)
+        },
+        {"$set": {
+            "original_text": original_text,
+            "summary": summary,
+            "method": method,
+            "timestamp": time.time()
+        }},
+        upsert=True
+    )
+
+def save_history(user_id, original_text, summary, method):
+    """Record a generated summary in the user's history in the background"""
+    future = history_writer.submit(write_history, user_id, original_text, summary, method)
+    with pending_history_lock:
+        pending_history_writes.setdefault(user_id, set()).add(future)
+
+    def on_done(done):
+        with pending_history_lock:
+            pending = pending_history_writes.get(user_id)
+            if pending is not None:
+                pending.discard(done)
+                if not pending:
+                    del pending_history_writes[user_id]
+        if done.exception():
+            print(f"Error saving history: {done.exception()}", file=sys.stderr)
+
+    future.add_done_callback(on_done)
+
+def wait_for_history(user_id, timeout=2):
+    """Wait briefly for this worker's pending history writes for a user to land"""
+    with pending_history_lock:
+        pending = list(pending_history_writes.get(user_id, ()))
+    if pending:
+        wait(pending, timeout=timeout)
+
+def sse_event(data):
+    """Format data as a server-sent event"""
+    return f"data: {json.dumps(data)}\n\n"
+
+def stream_summary(user_id, text):
+    """Stream a Gemini summary as server-sent events, always ending with the full result"""
+    key = text_hash(text, "gemini")
+    method = "gemini"
+
+    try:
+        summary = get_recent_summary(key) or get_cached_summary(key)
+        if summary is None:
+            chunks = []
+            for chunk in gemini_stream(text):
+                chunks.append(chunk)
+                yield sse_event({"text": chunk})
+            summary = ''.join(chunks)
+            if not summary:
+                raise Exception("Gemini API returned an empty summary")
+            remember_summary(key, summary)
+            try:
+                store_cached_summary(key, summary, method)
+            except Exception as e:
+                print(f"Error caching summary: {e}", file=sys.stderr)
+        else:
+            yield sse_event({"text": summary})
+    except Exception as e:
+        summary = local_summarize(text)
+        method = "local_fallback"
+        print(f"Streaming summarization failed, using fallback: {e}")
+
+    try:
+        save_history(user_id, text, summary, method)
+    except Exception as e:
+        print(f"Error saving history: {e}", file=sys.stderr)
+
+    yield sse_event({"done": True, "summary": summary, "method": method})
+
 # --- Routes ---
+@app.errorhandler(429)
+def rate_limit_exceeded(e):
+    """Report rate limiting as JSON like the other errors"""
+    return jsonify({"error": "Too many requests. Please wait a minute and try again."}), 429
+
 @app.route('/signup', methods=['POST'])
 def signup():
     """Handle user registration"""
@@ -132,7 +443,7 @@ def signup():
 
         user_id = users_collection.insert_one({
             "email": email,
-            "password": generate_password_hash(password),
+            "password": hash_password(password),
             "created_at": time.time()
         }).inserted_id
 
@@ -161,9 +472,15 @@ def login():
         if not user:
             return jsonify({"error": "Email not found. Please sign up first."}), 404
 
-        if not check_password_hash(user['password'], password):
+        if not verify_password(user['password'], password):
             return jsonify({"error": "Incorrect password."}), 401
 
+        if password_needs_rehash(user['password']):
+            users_collection.update_one(
+                {"_id": user['_id']},
+                {"$set": {"password": hash_password(password)}}
+            )
+
         return jsonify({
             "message": "Login successful!",
             "userId": str(user['_id']),
@@ -182,21 +499,68 @@ def get_history():
         if not user_id:
             return jsonify({"error": "User ID is required."}), 400
 
-        if not users_collection.find_one({"_id": ObjectId(user_id)}):
-            return jsonify({"error": "User not found."}), 404
+        if not ObjectId.is_valid(user_id):
+            return jsonify({"error": "Invalid user ID."}), 400
 
-        summaries = list(collection.find(
-            {"user_id": user_id},
-            {"_id": 0, "original_text": 1, "summary": 1, "timestamp": 1, "method": 1}
-        ).sort("timestamp", -1).limit(20))
+        if not user_exists(user_id):
+            return jsonify({"error": "User not found."}), 404
 
-        return jsonify(summaries), 200
+        # The UI reloads history right after /summarize returns. Writes from other
+        # workers aren't tracked, so an entry from one may still appear a moment late
+        wait_for_history(user_id)
+
+        summaries = list(collection.aggregate([
+            {"$match": {"user_id": user_id}},
+            {"$sort": {"timestamp": -1}},
+            {"$limit": 20},
+            {"$project": {
+                "_id": 0,
+                "id": {"$toString": "$_id"},
+                "original_text": {"$substrCP": ["$original_text", 0, HISTORY_PREVIEW_LENGTH]},
+                "summary": 1,
+                "timestamp": 1,
+                "method": 1
+            }}
+        ], batchSize=20))
+
+        return app.response_class(orjson.dumps(summaries), status=200, mimetype='application/json')
 
     except Exception as e:
         print(f"Error fetching history: {e}", file=sys.stderr)
         return jsonify({"error": str(e)}), 500
 
+@app.route('/history/<summary_id>/text', methods=['GET'])
+def get_history_text(summary_id):
+    """Fetch the full original text of one history entry"""
+    try:
+        user_id = request.args.get('userId')
+        if not user_id:
+            return jsonify({"error": "User ID is required."}), 400
+
+        if not ObjectId.is_valid(user_id):
+            return jsonify({"error": "Invalid user ID."}), 400
+
+        if not user_exists(user_id):
+            return jsonify({"error": "User not found."}), 404
+
+        if not ObjectId.is_valid(summary_id):
+            return jsonify({"error": "Invalid summary ID."}), 400
+
+        entry = collection.find_one(
+            {"_id": ObjectId(summary_id), "user_id": user_id},
+            {"_id": 0, "original_text": 1}
+        )
+        if not entry:
+            return jsonify({"error": "Summary not found."}), 404
+
+        return jsonify(entry), 200
+
+    except Exception as e:
+        print(f"Error fetching history text: {e}", file=sys.stderr)
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/summarize', methods=['POST'])
+@limiter.limit("30/minute")
 def summarize_text():
     """Handle text summarization with hybrid approach"""
     try:
@@ -205,35 +569,34 @@ def summarize_text():
             return jsonify({"error": "Text and user ID are required."}), 400
 
         user_id = data['userId']
-        if not users_collection.find_one({"_id": ObjectId(user_id)}):
+        if not ObjectId.is_valid(user_id):
+            return jsonify({"error": "Invalid user ID."}), 400
+
+        if not user_exists(user_id):
             return jsonify({"error": "User not found. Please login again."}), 404
 
         original_text = data['text'].strip()
         if len(original_text) < 20:
             return jsonify({"error": "Text must be at least 20 characters long."}), 400
 
+        if len(original_text) > MAX_TEXT_LENGTH:
+            return jsonify({"error": f"Text must be at most {MAX_TEXT_LENGTH:,} characters long."}), 413
+
         use_gemini = data.get('use_gemini', len(original_text) > 1000)
+        method = "gemini" if use_gemini and API_KEY else "local"
+
+        if method == "gemini" and data.get('stream'):
+            return Response(stream_with_context(stream_summary(user_id, original_text)),
+                            mimetype='text/event-stream')
         
         try:
-            if use_gemini and API_KEY:
-                summary = gemini_summarize(original_text)
-                method = "gemini"
-            else:
-                summary = local_summarize(original_text)
-                method = "local"
+            summary = coalesced_summarize(original_text, method)
         except Exception as e:
             summary = local_summarize(original_text)
             method = "local_fallback"
             print(f"Primary summarization failed, using fallback: {e}")
 
-        document = {
-            "user_id": user_id,
-            "original_text": original_text,
-            "summary": summary,
-            "method": method,
-            "timestamp": time.time()
-        }
-        collection.insert_one(document)
+        save_history(user_id, original_text, summary, method)
 
         return jsonify({
             "summary": summary,